@@ -1,8 +1,10 @@
+import hashlib
 import re
 import random
-from collections import Counter, defaultdict
+from bisect import bisect
 from typing import Dict, List, Tuple
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
@@ -14,104 +16,247 @@ import streamlit as st
 
 PUNKT = "."
 START = "<START>"
+# Feste Wortnummern für START und Punkt
+START_ID = 0
+PUNKT_ID = 1
 
 TOKEN_RE = re.compile(r"[A-Za-zÄÖÜäöüß0-9]+|[.!?]")
 
+# Übergänge in kompakter Form (wie eine dünn besetzte Matrix im CSR-Format):
+#   vokabular[i] -> Wort mit der Nummer i
+#   kontexte[k]  -> "Vorher" mit der Nummer k
+#   Die Nachfolger von kontexte[k] stehen in naechste[indptr[k]:indptr[k + 1]] (Wortnummern),
+#   ihre Häufigkeiten an denselben Stellen in anzahl.
+Uebergaenge = Tuple[List[str], List[Tuple[str, ...]], np.ndarray, np.ndarray, np.ndarray]
 
-def text_zu_woertern(text: str) -> List[str]:
-    """Text -> Wörterliste. ! und ? zählen wie ein Punkt."""
-    teile = TOKEN_RE.findall(text)
-    woerter = []
-    for t in teile:
-        if t in (".", "!", "?"):
-            woerter.append(PUNKT)
-        else:
-            woerter.append(t.lower())
-    return woerter
+# Auswahl-Tabelle pro "Vorher": (mögliche Wörter, kumulierte Gewichte bis 1, wahrscheinlichste Wörter)
+Auswahl = Tuple[Tuple[str, ...], Tuple[float, ...], Tuple[str, ...]]
+
+# Zwischenspeicher für das Modell: hängt nur vom Text und der Kontextlänge ab
+CACHE_TTL = 24 * 60 * 60
+
+
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL)
+def text_zu_woertern(text: str) -> Tuple[np.ndarray, List[str]]:
+    """
+    Text -> (Wortnummern, Vokabular). ! und ? zählen wie ein Punkt.
+    Das i-te Wort im Text ist vokabular[ids[i]].
+    """
+    # Satzzeichen und Kleinschreibung vorab auf dem ganzen Text,
+    # dann liefert findall direkt die fertige Wörterliste
+    text = text.replace("!", PUNKT).replace("?", PUNKT).lower()
+
+    # Wörter durchnummerieren, START und Punkt haben feste Nummern
+    wort_ids: Dict[str, int] = {START: START_ID, PUNKT: PUNKT_ID}
+    woerter = TOKEN_RE.findall(text)
+    ids = np.fromiter(
+        (wort_ids.setdefault(w, len(wort_ids)) for w in woerter),
+        dtype=np.int32,
+        count=len(woerter)
+    )
+    return ids, list(wort_ids)
 
 
 def baue_uebergaenge(
-    woerter: List[str],
+    ids: np.ndarray,
+    vokabular: List[str],
     anzahl_vorher: int
-) -> Tuple[Dict[Tuple[str, ...], Counter], Dict[Tuple[str, ...], int]]:
+) -> Uebergaenge:
     """
+    ids, vokabular: Ergebnis von text_zu_woertern
     anzahl_vorher:
       1 -> 2-Wörter-Modell: nächstes Wort hängt vom letzten Wort ab
       2 -> 3-Wörter-Modell: nächstes Wort hängt von den letzten zwei Wörtern ab
     """
-    start = tuple([START] * anzahl_vorher)
-
-    # START am Anfang und nach jedem Punkt
-    seq = list(start)
-    for w in woerter:
-        seq.append(w)
-        if w == PUNKT:
-            seq.extend(start)
-
-    uebergaenge: Dict[Tuple[str, ...], Counter] = defaultdict(Counter)
-    gesamt: Dict[Tuple[str, ...], int] = defaultdict(int)
-
-    for i in range(anzahl_vorher, len(seq)):
-        vorher = tuple(seq[i - anzahl_vorher:i])
-        naechstes = seq[i]
-        uebergaenge[vorher][naechstes] += 1
-        gesamt[vorher] += 1
-
-    return uebergaenge, gesamt
+    # Mit 64 Bit rechnen, damit zwei Wortnummern in eine Zahl passen
+    ids = ids.astype(np.int64)
+    anzahl_woerter = len(vokabular)
+
+    # Jeder Satz beginnt mit START, statt START-Wörter in die Folge einzufügen:
+    # stelle[i] = Position von Wort i in seinem Satz (0 = erstes Wort)
+    ist_punkt = ids == PUNKT_ID
+    satzbeginn = np.zeros(len(ids), dtype=np.int64)
+    satzbeginn[1:] = np.where(ist_punkt[:-1], np.arange(1, len(ids)), 0)
+    stelle = np.arange(len(ids)) - np.maximum.accumulate(satzbeginn)
+
+    # Jedes "Vorher" als eine Zahl: ein Wort -> seine Nummer,
+    # zwei Wörter -> erstes * Wortanzahl + zweites.
+    # Vorgänger außerhalb des Satzes sind START.
+    p1 = np.where(stelle >= 1, np.roll(ids, 1), START_ID)
+    if anzahl_vorher == 1:
+        vorher = p1
+        # Punkt -> START
+        satzende_vorher = np.full(int(ist_punkt.sum()), PUNKT_ID, dtype=np.int64)
+    else:
+        vorher = np.where(stelle >= 2, np.roll(ids, 2), START_ID) * anzahl_woerter + p1
+        # (…, Punkt) -> START und (Punkt, START) -> START
+        satzende_vorher = np.concatenate((
+            p1[ist_punkt] * anzahl_woerter + PUNKT_ID,
+            np.full(int(ist_punkt.sum()), PUNKT_ID * anzahl_woerter + START_ID, dtype=np.int64)
+        ))
+    vorher = np.concatenate((vorher, satzende_vorher))
+    naechstes = np.concatenate((ids, np.full(len(satzende_vorher), START_ID, dtype=np.int64)))
+
+    # "Vorher" durchnummerieren und gleiche Paare zählen:
+    # jedes Paar als eine Zahl kontext * Wortanzahl + wort
+    kontext_schluessel, kontext = np.unique(vorher, return_inverse=True)
+    schluessel = kontext * anzahl_woerter + naechstes
+    eindeutig, erstes_mal, anzahl = np.unique(schluessel, return_index=True, return_counts=True)
+
+    # Nach "Vorher" ordnen, die Nachfolger in der Reihenfolge, in der sie im Text vorkommen
+    kontext = eindeutig // anzahl_woerter
+    reihenfolge = np.lexsort((erstes_mal, kontext))
+    kontext = kontext[reihenfolge]
+    naechste = (eindeutig % anzahl_woerter)[reihenfolge]
+    anzahl = anzahl[reihenfolge]
+
+    anzahl_kontexte = len(kontext_schluessel)
+    indptr = np.zeros(anzahl_kontexte + 1, dtype=np.int64)
+    np.cumsum(np.bincount(kontext, minlength=anzahl_kontexte), out=indptr[1:])
+
+    # Nummern der "Vorher" wieder in Wörter zurückübersetzen
+    if anzahl_vorher == 1:
+        kontexte = [(vokabular[i],) for i in kontext_schluessel.tolist()]
+    else:
+        erste, zweite = np.divmod(kontext_schluessel, anzahl_woerter)
+        kontexte = [(vokabular[i], vokabular[j]) for i, j in zip(erste.tolist(), zweite.tolist())]
+
+    return vokabular, kontexte, indptr, naechste, anzahl
+
+
+def beste_woerter_je_vorher(uebergaenge: Uebergaenge) -> List[Tuple[str, ...]]:
+    """Für jedes kontexte[k]: die Wörter mit der größten Häufigkeit (für 0% Zufall)."""
+    vokabular, kontexte, indptr, naechste, anzahl = uebergaenge
+    if not kontexte:
+        return []
+    zeilen_max = np.maximum.reduceat(anzahl, indptr[:-1])
+    ist_bestes = (anzahl == np.repeat(zeilen_max, np.diff(indptr))).tolist()
+    naechste_liste = naechste.tolist()
+    grenzen = indptr.tolist()
+    return [
+        tuple(vokabular[i] for i, ist_best in zip(naechste_liste[a:b], ist_bestes[a:b]) if ist_best)
+        for a, b in zip(grenzen, grenzen[1:])
+    ]
+
+
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL)
+def _build(
+    text: str,
+    anzahl_vorher: int
+) -> Tuple[Uebergaenge, List[Tuple[str, ...]], Tuple[int, int]]:
+    """
+    Text -> (uebergaenge, beste_woerter, (nur_eine, gesamt_vorher)).
+    nur_eine: Anzahl der "Vorher", nach denen nur ein Wort folgen kann.
+    Wird nur neu berechnet, wenn sich Text oder Modell ändern.
+    """
+    ids, vokabular = text_zu_woertern(text)
+    uebergaenge = baue_uebergaenge(ids, vokabular, anzahl_vorher)
+    # Anzahl möglicher nächster Wörter pro "Vorher" = Länge seiner Zeile
+    moeglichkeiten = np.diff(uebergaenge[2])
+    hinweis = (int((moeglichkeiten == 1).sum()), len(moeglichkeiten))
+    return uebergaenge, beste_woerter_je_vorher(uebergaenge), hinweis
 
 
-def tabelle_bauen(
-    uebergaenge: Dict[Tuple[str, ...], Counter],
-    gesamt: Dict[Tuple[str, ...], int]
-) -> pd.DataFrame:
+def tabelle_bauen(uebergaenge: Uebergaenge) -> pd.DataFrame:
     """Tabelle: Vorher -> Nächstes Wort -> Wahrscheinlichkeit."""
-    zeilen = []
-    for vorher, cnt in uebergaenge.items():
-        total = gesamt[vorher]
-        for naechstes, anzahl in cnt.items():
-            zeilen.append({
-                "Vorher": " ".join(vorher),
-                "Nächstes Wort": naechstes,
-                "Wahrscheinlichkeit": anzahl / total if total else 0.0
-            })
-    df = pd.DataFrame(zeilen)
+    vokabular, kontexte, indptr, naechste, anzahl = uebergaenge
+    # Jede Zeile der Tabelle ist ein Eintrag in naechste/anzahl
+    zeilen_pro_vorher = np.diff(indptr)
+    # Übergänge pro "Vorher" = Summe seiner Zeile
+    gesamt = np.diff(np.concatenate(([0], np.cumsum(anzahl)))[indptr])
+    df = pd.DataFrame({
+        "Vorher": np.repeat(np.array([" ".join(vorher) for vorher in kontexte], dtype=object), zeilen_pro_vorher),
+        "Nächstes Wort": np.array(vokabular, dtype=object)[naechste],
+        "Wahrscheinlichkeit": anzahl / np.repeat(gesamt, zeilen_pro_vorher)
+    })
     if not df.empty:
         df = df.sort_values(["Vorher", "Wahrscheinlichkeit"], ascending=[True, False]).reset_index(drop=True)
     return df
 
 
-def waehle_naechstes(cnt: Counter, zufall: int, rng: random.Random) -> str:
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL)
+def _table(
+    modell_key: str,
+    _uebergaenge: Uebergaenge
+) -> Tuple[pd.DataFrame, Dict[str, Tuple[int, int]]]:
+    """
+    Übergänge -> (Tabelle, bereiche).
+    bereiche: "Vorher" -> (erste Zeile, letzte Zeile + 1) in der Tabelle, für die Suche.
+    Gecacht nur über modell_key, _uebergaenge wird von Streamlit nicht gehasht.
+    """
+    df = tabelle_bauen(_uebergaenge)
+    # Die Tabelle ist nach "Vorher" sortiert, jedes "Vorher" ist also ein zusammenhängender Bereich
+    bereiche = {
+        vorher: (int(zeilen[0]), int(zeilen[-1]) + 1)
+        for vorher, zeilen in df.groupby("Vorher", sort=False).indices.items()
+    }
+    return df, bereiche
+
+
+def auswahl_tabellen(
+    uebergaenge: Uebergaenge,
+    beste_woerter: List[Tuple[str, ...]],
+    zufall: int
+) -> Dict[Tuple[str, ...], Auswahl]:
     """
+    Übergänge -> Auswahl-Tabelle für jedes "Vorher".
     zufall:
-      0   -> immer das wahrscheinlichste Wort
+      0   -> immer das wahrscheinlichste Wort (beste_woerter)
       100 -> komplett zufällig (alle möglichen nächsten Wörter gleich wahrscheinlich)
       dazwischen -> Mischung
     """
-    moeglich = list(cnt.keys())
-    if not moeglich:
-        return PUNKT
-
-    # 0% Zufall
-    if zufall <= 0:
-        best = max(cnt.values())
-        beste_woerter = [w for w, c in cnt.items() if c == best]
-        return rng.choice(beste_woerter)
-
-    # 100% Zufall
-    if zufall >= 100:
-        return rng.choice(moeglich)
+    vokabular, kontexte, indptr, naechste, anzahl = uebergaenge
+    if not kontexte:
+        return {}
 
-    # Mischung über Gewichte:
+    # Mischung über Gewichte, für alle Übergänge auf einmal (bei 100% sind alle Gewichte 1):
     # alpha = Zufall/100
     # Gewicht = (1-alpha)*Häufigkeit + alpha*1
     alpha = zufall / 100.0
-    weights = []
-    for w in moeglich:
-        haeufigkeit = cnt[w]
-        gewicht = (1 - alpha) * haeufigkeit + alpha * 1
-        weights.append(gewicht)
+    kumuliert = np.cumsum((1.0 - alpha) * anzahl + alpha)
+    # Aufsummieren soll in jeder Zeile wieder bei 0 beginnen ...
+    zeilen_pro_vorher = np.diff(indptr)
+    kumuliert -= np.repeat(np.concatenate(([0.0], kumuliert))[indptr[:-1]], zeilen_pro_vorher)
+    # ... und bei 1 enden, dann muss beim Ziehen nichts mehr umgerechnet werden
+    kumuliert /= np.repeat(kumuliert[indptr[1:] - 1], zeilen_pro_vorher)
+
+    naechste_woerter = [vokabular[i] for i in naechste.tolist()]
+    kumuliert_liste = kumuliert.tolist()
+    grenzen = indptr.tolist()
+
+    return {
+        vorher: (tuple(naechste_woerter[a:b]), tuple(kumuliert_liste[a:b]), beste)
+        for vorher, a, b, beste in zip(kontexte, grenzen, grenzen[1:], beste_woerter)
+    }
+
+
+# Ersatz, falls es für den Start-Zustand gar keine Übergänge gibt
+NUR_PUNKT: Auswahl = ((PUNKT,), (1.0,), (PUNKT,))
+
+
+@st.cache_data(show_spinner=False, ttl=CACHE_TTL)
+def _sampling_tables(
+    modell_key: str,
+    zufall: int,
+    _uebergaenge: Uebergaenge,
+    _beste_woerter: List[Tuple[str, ...]]
+) -> Dict[Tuple[str, ...], Auswahl]:
+    """Auswahl-Tabelle für jedes "Vorher". Einmal pro Modell und Temperatur."""
+    return auswahl_tabellen(_uebergaenge, _beste_woerter, zufall)
+
 
-    return rng.choices(moeglich, weights=weights, k=1)[0]
+def waehle_naechstes(auswahl: Auswahl, zufall: int, rng: random.Random) -> str:
+    """Zieht das nächste Wort aus einer vorberechneten Auswahl-Tabelle."""
+    moeglich, kumuliert, beste_woerter = auswahl
+
+    # 0% Zufall: meistens gibt es genau ein wahrscheinlichstes Wort
+    if zufall <= 0:
+        if len(beste_woerter) == 1:
+            return beste_woerter[0]
+        return rng.choice(beste_woerter)
+
+    # Wie random.choices, aber die Gewichte sind schon aufsummiert und normiert
+    return moeglich[bisect(kumuliert, rng.random(), 0, len(kumuliert) - 1)]
 
 
 def satzanfang_zu_start(
@@ -142,7 +287,7 @@ def satzanfang_zu_start(
 
 
 def satz_erzeugen(
-    uebergaenge: Dict[Tuple[str, ...], Counter],
+    tabellen: Dict[Tuple[str, ...], Auswahl],
     anzahl_vorher: int,
     zufall: int,
     max_woerter: int,
@@ -156,18 +301,23 @@ def satz_erzeugen(
     vorher = start
 
     for _ in range(max_woerter):
-        cnt = uebergaenge.get(vorher)
-        if not cnt:
+        auswahl = tabellen.get(vorher)
+        if not auswahl:
             vorher = start
-            cnt = uebergaenge.get(vorher, Counter({PUNKT: 1}))
+            auswahl = tabellen.get(vorher, NUR_PUNKT)
 
-        naechstes = waehle_naechstes(cnt, zufall, rng)
+        naechstes = waehle_naechstes(auswahl, zufall, rng)
 
         # Satz darf nicht mit Punkt starten
         if not ausgabe and naechstes == PUNKT:
             vorher = start
             continue
 
+        # Satzende: Punkt ohne Leerzeichen direkt ans letzte Wort
+        if naechstes == PUNKT:
+            ausgabe[-1] += PUNKT
+            return " ".join(ausgabe)
+
         ausgabe.append(naechstes)
 
         # Fenster aktualisieren
@@ -176,24 +326,10 @@ def satz_erzeugen(
         else:
             vorher = (vorher[-1], naechstes)
 
-        if naechstes == PUNKT:
-            break
-
     # Wenn kein Punkt kam: Punkt anhängen
-    if ausgabe and ausgabe[-1] != PUNKT:
-        ausgabe.append(PUNKT)
-
-    # Punkt ohne Leerzeichen davor
-    s = []
-    for w in ausgabe:
-        if w == PUNKT:
-            if s:
-                s[-1] = s[-1] + PUNKT
-            else:
-                s.append(PUNKT)
-        else:
-            s.append(w)
-    return " ".join(s)
+    if ausgabe:
+        ausgabe[-1] += PUNKT
+    return " ".join(ausgabe)
 
 
 # -----------------------------
@@ -302,16 +438,22 @@ if "rng" not in st.session_state:
 
 rng = st.session_state.rng
 
+# Intern: Modell und Tabelle nur neu holen, wenn sich Text oder Kontextlänge ändern.
+# Bei Temperatur, Satzanfang, Suche usw. wird alles aus session_state weiterverwendet.
+# Der Text wird pro Durchlauf einmal gehasht, die gecachten Funktionen bekommen nur den kurzen Schlüssel.
+modell_key = f"{hashlib.blake2s(text.encode(), digest_size=16).hexdigest()}-{anzahl_vorher}"
+if st.session_state.get("model_key") != modell_key:
+    uebergaenge, beste_woerter, hinweis = _build(text, anzahl_vorher)
+    st.session_state.model = (uebergaenge, beste_woerter, hinweis, *_table(modell_key, uebergaenge))
+    st.session_state.model_key = modell_key
 
-woerter = text_zu_woertern(text)
-uebergaenge, gesamt = baue_uebergaenge(woerter, anzahl_vorher)
+uebergaenge, beste_woerter, (nur_eine, gesamt_vorher), df, bereiche = st.session_state.model
 
 colA, colB = st.columns([1, 1], gap="large")
 
 with colA:
     st.subheader("2. Übergangstabelle")
 
-    df = tabelle_bauen(uebergaenge, gesamt)
     if df.empty:
         st.warning("Bitte mehr Text eingeben.")
     else:
@@ -338,7 +480,8 @@ with colA:
 
             else:
                 gesucht = " ".join(teile)
-                df_anzeige = df[df["Vorher"] == gesucht]
+                von, bis = bereiche.get(gesucht, (0, 0))
+                df_anzeige = df.iloc[von:bis]
                 if df_anzeige.empty:
                     st.warning(
                         f"„{gesucht}“ kommt als „Vorher“ im Text nicht vor. "
@@ -348,9 +491,6 @@ with colA:
         st.dataframe(df_anzeige, use_container_width=True, height=520)
 
         # Hinweis, warum Zufall manchmal nichts ändert
-        moeglichkeiten = df.groupby("Vorher")["Nächstes Wort"].nunique()
-        nur_eine = int((moeglichkeiten == 1).sum())
-        gesamt_vorher = int(len(moeglichkeiten))
         st.caption(
             f"Info: Bei {nur_eine} von {gesamt_vorher} Fällen gibt es nur **ein** mögliches nächstes Wort. "
             "Dann kann der Zufall-Regler nichts ändern."
@@ -367,10 +507,11 @@ with colB:
         else:
             # Nur hier löschen/neu erzeugen:
             st.session_state.generated_sentences = []
+            tabellen = _sampling_tables(modell_key, int(zufall), uebergaenge, beste_woerter)
 
             for i in range(int(anzahl_saetze)):
                 s = satz_erzeugen(
-                    uebergaenge,
+                    tabellen,
                     anzahl_vorher,
                     int(zufall),
                     int(max_woerter),